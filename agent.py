@@ -1,9 +1,14 @@
+import os
+import re
+import unicodedata
+
 from pydantic import BaseModel, Field
 from typing import Optional, List
 from trustcall import create_extractor
 from database.pg_vector import SupabaseVectorDB
+from database.tenant_index import TenantFaqIndex
 
-from langchain_core.messages import SystemMessage
+from langchain_core.messages import AIMessage, SystemMessage
 from langchain_core.runnables.config import RunnableConfig
 from langchain_google_vertexai import ChatVertexAI
 from langchain_huggingface import HuggingFaceEmbeddings
@@ -11,9 +16,34 @@ from langgraph.graph import StateGraph, MessagesState, START, END
 from langgraph.store.base import BaseStore
 
 import configuration
+from resilience import ConcurrencyLimitError, ConcurrencyLimiter, call_with_deadline
+
+# --------------------- TIMEOUTS E CONCORRÊNCIA ---------------------
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "1.5"))  # embedding + busca
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", "30"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "5"))
+
+# Limita as chamadas simultâneas ao Vertex (resposta e extração de memória)
+llm_limiter = ConcurrencyLimiter("llm", LLM_MAX_CONCURRENCY, LLM_QUEUE_TIMEOUT)
+
+# Resposta usada quando o modelo não responde a tempo
+FALLBACK_MESSAGE = (
+    "Desculpe, tive uma instabilidade para responder agora. "
+    "Poderia repetir sua última mensagem, por favor?"
+)
 
 # --------------------- LLM SETUP ---------------------
-model = ChatVertexAI(model="gemini-2.0-flash-lite-001", temperature=0, max_tokens=200)
+# O timeout do cliente encerra de fato a chamada abandonada pelo limitador, liberando
+# a vaga; sem ele a requisição ao Vertex seguiria em segundo plano indefinidamente
+model = ChatVertexAI(
+    model="gemini-2.0-flash-lite-001",
+    temperature=0,
+    max_tokens=200,
+    max_retries=1,
+    timeout=LLM_TIMEOUT,
+)
 
 # --------------------- EMBEDDING SETUP ---------------------
 hf = HuggingFaceEmbeddings(
@@ -72,12 +102,7 @@ Aqui está a memória (talvez esteja vazia): {memory}
 
 Seu papel é entender o momento do lead, educar sobre consórcio quando necessário e extrair, ao longo da conversa, as informações da memória.
 
-INFORMAÇÕES TÉCNICAS RELEVANTES:
-{rag_context}
-
-Use as informações técnicas acima quando forem relevantes para responder às perguntas do usuário sobre consórcios.
-Se as informações técnicas não forem relevantes para a pergunta atual, ignore-as e responda naturalmente.
-
+{rag_section}
 Foque em coletar os seguintes dados, naturalmente ao longo da conversa:
 • [Necessidade principal]
 • [Valor desejado do bem ou negócio]
@@ -89,6 +114,14 @@ Foque em coletar os seguintes dados, naturalmente ao longo da conversa:
 • [Forma de tomada de decisão: forma de decidir, o que leva em consideração, como funciona o processo decisório]
 """
 
+# Contexto técnico (omitido quando a busca RAG é pulada)
+RAG_SECTION = """INFORMAÇÕES TÉCNICAS RELEVANTES:
+{rag_context}
+
+Use as informações técnicas acima quando forem relevantes para responder às perguntas do usuário sobre consórcios.
+Se as informações técnicas não forem relevantes para a pergunta atual, ignore-as e responda naturalmente.
+"""
+
 # Extraction instruction
 TRUSTCALL_INSTRUCTION = """
 Você é um agente responsável por atualizar a memória (JSON doc) do usuário com base na conversa abaixo.
@@ -123,28 +156,255 @@ Retorne apenas o objeto JSON `UserProfile` com os campos preenchidos ou atualiza
 
 # --------------------- VETOR DB INSTANCE ---------------------
 vector_db = SupabaseVectorDB()
+local_index = TenantFaqIndex(vector_db)
 
 
 # --------------------- RAG RETRIEVAL ---------------------
-def get_rag_retrieval(query: str) -> str:
-    try:
-        # Etapa 1: Geração do embedding
-        processed_query = query.strip().lower()
-        query_embedding = hf.embed_query(processed_query)
+def search_faqs(
+    query: str, tenant_id: str = "default", use_local_index: bool = False
+) -> List[dict]:
+    # Etapa 1: Geração do embedding
+    processed_query = query.strip().lower()
+    query_embedding = hf.embed_query(processed_query)
+
+    # Etapa 2: Busca vetorial restrita ao corpus do tenant
+    index = local_index if use_local_index else vector_db
+    return index.search_similar_faqs(
+        query_embedding=query_embedding, top_k=3, tenant_id=tenant_id
+    )
 
-        # Etapa 2: Busca vetorial
-        results = vector_db.search_similar_faqs(
-            query_embedding=query_embedding, top_k=3
-        )
 
-        if not results:
-            return "Nenhuma informação relevante encontrada."
+def format_rag_context(results: List[dict]) -> str:
+    if not results:
+        return "Nenhuma informação relevante encontrada."
 
-        response = [f"Q: {r['pergunta']}\nA: {r['resposta']}" for r in results]
-        return "\n\n---\n\n".join(response)
+    response = [f"Q: {r['pergunta']}\nA: {r['resposta']}" for r in results]
+    return "\n\n---\n\n".join(response)
+
+
+def get_rag_retrieval(
+    query: str, tenant_id: str = "default", use_local_index: bool = False
+) -> tuple[str, List[dict]]:
+    try:
+        results = call_with_deadline(
+            search_faqs, RETRIEVAL_TIMEOUT, query, tenant_id, use_local_index
+        )
+        return format_rag_context(results), results
+
+    except TimeoutError:
+        # O banco travado não chega a levantar erro dentro do prazo; conta no circuito
+        vector_db.record_timeout()
+        print("Busca de informações de suporte técnico excedeu o prazo.")
+        return format_rag_context([]), []
 
     except Exception as e:
-        return f"Erro ao buscar informações de suporte técnico: {e}"
+        # Falha ou lentidão na busca degrada para "sem contexto"
+        print(f"Erro ao buscar informações de suporte técnico: {e!r}")
+        return format_rag_context([]), []
+
+
+# --------------------- ANSWER CACHE ---------------------
+INFORMATIONAL_PREFIXES = (
+    "o que",
+    "como",
+    "qual",
+    "quais",
+    "quando",
+    "quanto",
+    "quantos",
+    "quantas",
+    "por que",
+    "existe",
+    "posso",
+    "pode",
+    "é possível",
+)
+
+
+def is_informational_question(message: str) -> bool:
+    text = message.strip().lower()
+    return text.endswith("?") or text.startswith(INFORMATIONAL_PREFIXES)
+
+
+# Marca das respostas servidas pelo cache (response_metadata["origem"])
+CACHE_ORIGIN = "faq_cache"
+UNKNOWN_VALUES = {"", "desconhecido", "desconhecida"}
+
+# Dados de qualificação que o SDR coleta, na ordem em que devem ser perguntados
+QUALIFICATION_QUESTIONS = {
+    "necessidade": "Para eu entender melhor o seu momento, o que você pretende conquistar com o consórcio?",
+    "valor_desejado": "Você já tem uma ideia do valor aproximado do bem ou do objetivo que deseja alcançar?",
+    "urgencia": "Em quanto tempo você gostaria de realizar esse plano?",
+    "nivel_conhecimento_consorcio": "Você já teve alguma experiência com consórcio ou este é o seu primeiro contato?",
+    "disponibilidade_lance": "Você imagina ter algum valor reservado para oferecer como lance ao longo do plano?",
+    "finalidade": "A ideia é usar o bem para você mesmo ou como investimento?",
+    "orcamento_mensal": "Qual valor mensal ficaria confortável no seu orçamento?",
+    "tomada_decisao": "Como costuma ser a decisão para um plano como este: você decide por conta própria ou com mais alguém?",
+}
+
+
+def next_qualification_question(mem: Optional[dict]) -> Optional[str]:
+    """Próxima pergunta de qualificação pendente no perfil, ou None se já está completo."""
+    for field, question in QUALIFICATION_QUESTIONS.items():
+        if str((mem or {}).get(field) or "").strip().lower() in UNKNOWN_VALUES:
+            return question
+    return None
+
+
+def get_cached_answer(
+    messages: list,
+    message: str,
+    results: List[dict],
+    mem: Optional[dict],
+    threshold: Optional[float],
+) -> Optional[str]:
+    """Retorna a resposta pré-renderizada do FAQ quando o atalho sem LLM se aplica.
+
+    Regra: a mensagem é uma pergunta informativa, o FAQ mais próximo tem
+    similaridade acima do limiar e resposta no cache, e o turno anterior não veio do
+    cache (a extração de memória, pulada nos turnos do cache, atrasa no máximo um
+    turno). Para o fluxo de qualificação não parar, a resposta termina com a próxima
+    pergunta pendente entre os dados que o SDR coleta (QUALIFICATION_QUESTIONS).
+    """
+    if threshold is None or not results:
+        return None
+
+    best = results[0]
+    if best["similaridade"] < threshold or not best.get("resposta_renderizada"):
+        return None
+    if not is_informational_question(message):
+        return None
+
+    previous_ai = next((m for m in reversed(messages[:-1]) if m.type == "ai"), None)
+    if previous_ai and previous_ai.response_metadata.get("origem") == CACHE_ORIGIN:
+        return None
+
+    follow_up = next_qualification_question(mem)
+    if follow_up:
+        return f"{best['resposta_renderizada']}\n\n{follow_up}"
+    return best["resposta_renderizada"]
+
+
+# --------------------- RETRIEVAL GATE ---------------------
+# Termos (sem acento) que indicam uma dúvida técnica sobre consórcio
+TECHNICAL_TERMS = (
+    "consorci",
+    "lance",
+    "carta de credito",
+    "credito",
+    "contempla",
+    "sorteio",
+    "assembleia",
+    "parcela",
+    "taxa",
+    "administradora",
+    "adesao",
+    "fundo de reserva",
+    "seguro",
+    "cota",
+    "grupo",
+    "reajuste",
+    "fgts",
+    "bacen",
+    "inadimpl",
+    "desist",
+    "quitar",
+    "quitacao",
+    "transferencia",
+    "financiamento",
+)
+SMALL_TALK = (
+    "oi",
+    "ola",
+    "opa",
+    "bom dia",
+    "boa tarde",
+    "boa noite",
+    "tudo bem",
+    "tudo bom",
+    "tudo certo",
+    "como vai",
+    "como voce esta",
+    "e voce",
+    "e com voce",
+    "sim",
+    "nao",
+    "ok",
+    "certo",
+    "claro",
+    "beleza",
+    "obrigado",
+    "obrigada",
+    "valeu",
+    "tchau",
+)
+SMALL_TALK_PREFIX = re.compile(
+    r"^(?:(?:%s)\b\s*)+" % "|".join(sorted(SMALL_TALK, key=len, reverse=True))
+)
+# Indícios de pergunta informativa, procurados em qualquer ponto da mensagem
+INFORMATIONAL_CUES = (
+    "como funciona",
+    "como faco",
+    "como e",
+    "o que e",
+    "o que significa",
+    "qual",
+    "quais",
+    "quanto",
+    "quantos",
+    "quantas",
+    "quando",
+    "por que",
+    "e possivel",
+    "posso",
+    "existe",
+    "diferenca",
+    "vale a pena",
+)
+EMAIL_PATTERN = re.compile(r"^\S+@\S+\.\S+$")
+NUMERIC_PATTERN = re.compile(r"^[\d\s()+\-.,r$kmil]+$")  # telefones e valores
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.strip().lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[^\w\s@.$+\-()]", "", text).strip()
+
+
+def needs_retrieval(message: str) -> bool:
+    """Classificador por regras: decide se a mensagem precisa de contexto técnico do FAQ."""
+    text = _normalize(message)
+    if any(term in text for term in TECHNICAL_TERMS):
+        return True
+
+    # E-mails, telefones e valores
+    if not text or EMAIL_PATTERN.match(text) or NUMERIC_PATTERN.match(text):
+        return False
+
+    # Remove saudações e confirmações do início ("Oi, tudo bem?", "Não sei como...")
+    words = " ".join(re.sub(r"[^\w\s]", " ", text).split())
+    remainder = SMALL_TALK_PREFIX.sub("", words).strip()
+    if not remainder:
+        return False
+
+    padded = f" {remainder} "
+    if any(f" {cue} " in padded for cue in INFORMATIONAL_CUES):
+        return True
+
+    # Outra pergunta que sobrou após remover a conversa social ("E o prazo?")
+    return message.strip().endswith("?")
+
+
+def message_text(message) -> str:
+    """Texto da mensagem, aceitando conteúdo em string ou lista de blocos (chat UIs)."""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return " ".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in content
+        if isinstance(block, str) or block.get("type") == "text"
+    ).strip()
 
 
 # --------------------- CHATBOT NODE ---------------------
@@ -154,9 +414,9 @@ def call_model(state: MessagesState, config: RunnableConfig, store: BaseStore):
 
     namespace = ("memory", user_id)
     existing_memory = store.get(namespace, "user_memory")
+    mem = existing_memory.value if existing_memory else None
 
-    if existing_memory and existing_memory.value:
-        mem = existing_memory.value
+    if mem:
         formatted_memory = (
             f"Nome: {mem.get('nome', 'Desconhecido')}\n"
             f"Sobrenome: {mem.get('sobrenome', 'Desconhecido')}\n"
@@ -174,16 +434,47 @@ def call_model(state: MessagesState, config: RunnableConfig, store: BaseStore):
     else:
         formatted_memory = "Nenhuma informação disponível ainda."
 
-    user_message = state["messages"][-1].content
+    user_message = message_text(state["messages"][-1])
     print(
         f"Mensagem do usuário: {user_message}"
     )  # Debug: Verificar a mensagem do usuário
-    rag_context = get_rag_retrieval(user_message)
+    # Só busca no FAQ quando a mensagem é uma dúvida sobre consórcio
+    if configurable.adaptive_retrieval and not needs_retrieval(user_message):
+        rag_section, rag_results = "", []
+    else:
+        rag_context, rag_results = get_rag_retrieval(
+            user_message, configurable.tenant_id, configurable.use_local_index
+        )
+        rag_section = RAG_SECTION.format(rag_context=rag_context)
+
+    # Atalho: pergunta informativa com FAQ muito similar (ver get_cached_answer)
+    cached_answer = get_cached_answer(
+        state["messages"],
+        user_message,
+        rag_results,
+        mem,
+        configurable.answer_cache_threshold,
+    )
+    if cached_answer:
+        print(f"Resposta do cache: {cached_answer}")
+        return {
+            "messages": AIMessage(
+                content=cached_answer, response_metadata={"origem": CACHE_ORIGIN}
+            )
+        }
 
     system_msg = MODEL_SYSTEM_MESSAGE.format(
-        memory=formatted_memory, rag_context=rag_context
+        memory=formatted_memory, rag_section=rag_section
     )
-    response = model.invoke([SystemMessage(content=system_msg)] + state["messages"])
+    try:
+        response = llm_limiter.call(
+            model.invoke,
+            LLM_TIMEOUT,
+            [SystemMessage(content=system_msg)] + state["messages"],
+        )
+    except (TimeoutError, ConcurrencyLimitError) as e:
+        print(f"Modelo indisponível: {e!r} | {llm_limiter.metrics()}")
+        response = AIMessage(content=FALLBACK_MESSAGE)
 
     print(f"Resposta do modelo: {response}")  # Debug: Verificar a resposta do modelo
     return {"messages": response}
@@ -205,13 +496,20 @@ def write_memory(state: MessagesState, config: RunnableConfig, store: BaseStore)
     print(f"Perfil existente: {existing_profile}")
 
     # Chamada ao extrator de dados para atualizar a memória
-    result = trustcall_extractor.invoke(
-        {
-            "messages": [SystemMessage(content=TRUSTCALL_INSTRUCTION)]
-            + state["messages"],
-            "existing": existing_profile,
-        }
-    )
+    try:
+        result = llm_limiter.call(
+            trustcall_extractor.invoke,
+            EXTRACTION_TIMEOUT,
+            {
+                "messages": [SystemMessage(content=TRUSTCALL_INSTRUCTION)]
+                + state["messages"],
+                "existing": existing_profile,
+            },
+        )
+    except (TimeoutError, ConcurrencyLimitError) as e:
+        # Mantém a memória atual; ela será atualizada no próximo turno
+        print(f"Extração indisponível: {e!r} | {llm_limiter.metrics()}")
+        return
 
     # Log para inspeção do resultado da extração
     print(f"Resultado da extração: {result}")
@@ -230,11 +528,19 @@ def write_memory(state: MessagesState, config: RunnableConfig, store: BaseStore)
         print("Nenhuma resposta válida encontrada para atualizar a memória.")
 
 
+# --------------------- ROTEAMENTO ---------------------
+def route_after_model(state: MessagesState) -> str:
+    # Turnos do cache não chamam o extrator; a conversa inteira é extraída no próximo
+    if state["messages"][-1].response_metadata.get("origem") == CACHE_ORIGIN:
+        return END
+    return "write_memory"
+
+
 # --------------------- GRAPH ---------------------
 builder = StateGraph(MessagesState, config_schema=configuration.Configuration)
 builder.add_node("call_model", call_model)
 builder.add_node("write_memory", write_memory)
 builder.add_edge(START, "call_model")
-builder.add_edge("call_model", "write_memory")
+builder.add_conditional_edges("call_model", route_after_model, ["write_memory", END])
 builder.add_edge("write_memory", END)
 graph = builder.compile()
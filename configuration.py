@@ -7,11 +7,32 @@ from typing_extensions import Annotated
 from dataclasses import dataclass
 
 
+# Campos definidos por conversa: o valor de "configurable" prevalece sobre o ambiente
+CONFIGURABLE_FIRST = {"tenant_id"}
+
+
 @dataclass(kw_only=True)
 class Configuration:
     """The configurable fields for the chatbot."""
 
     user_id: str = "default-user"
+    # Marca de consórcio (corpus de FAQ) atendida por esta conversa; apenas [a-z0-9_]
+    tenant_id: str = "default"
+    # Buscar no índice local em memória do tenant em vez do pgvector
+    use_local_index: bool = False
+    # Pular a busca RAG em mensagens que não são dúvidas sobre consórcio
+    adaptive_retrieval: bool = True
+    # Similaridade mínima para responder direto do cache de respostas (None desativa)
+    answer_cache_threshold: Optional[float] = None
+
+    def __post_init__(self):
+        # Valores vindos de variáveis de ambiente chegam como string
+        if self.answer_cache_threshold is not None:
+            self.answer_cache_threshold = float(self.answer_cache_threshold)
+        for name in ("use_local_index", "adaptive_retrieval"):
+            value = getattr(self, name)
+            if isinstance(value, str):
+                setattr(self, name, value.lower() in ("1", "true", "yes"))
 
     @classmethod
     def from_runnable_config(
@@ -22,8 +43,12 @@ class Configuration:
             config["configurable"] if config and "configurable" in config else {}
         )
         values: dict[str, Any] = {
-            f.name: os.environ.get(f.name.upper(), configurable.get(f.name))
+            f.name: (
+                configurable.get(f.name, os.environ.get(f.name.upper()))
+                if f.name in CONFIGURABLE_FIRST
+                else os.environ.get(f.name.upper(), configurable.get(f.name))
+            )
             for f in fields(cls)
             if f.init
         }
-        return cls(**{k: v for k, v in values.items() if v})
+        return cls(**{k: v for k, v in values.items() if v is not None and v != ""})
@@ -1,11 +1,17 @@
 import json
 import os
+import re
+import sys
 import psycopg2
 from psycopg2 import extras, extensions
 from dotenv import load_dotenv
 from transformers import AutoTokenizer, AutoModel
 import torch
 
+# Permite reutilizar as funções de deduplicação de refactor_json (raiz do repositório)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from refactor_json import build_embedding_input, jaccard, shingles
+
 load_dotenv()
 
 # Informações de conexão com o banco PostgreSQL (Supabase)
@@ -18,10 +24,28 @@ POSTGRES_PASS = os.getenv("SUPABASE_DB_PASSWORD")
 # Caminho do JSON com os dados
 JSON_FILE_PATH = "S:/Code/LangGraph_study/HandsOn/data/faq.json"
 
+# Tenant (marca de consórcio) dono do FAQ ingerido. Variável própria da ingestão:
+# TENANT_ID no .env não deve influenciar o tenant das conversas
+TENANT_ID = os.getenv("INGEST_TENANT_ID", "default")
+# O tenant vira parte do nome do índice parcial, então só aceita [a-z0-9_]:
+# ids com hífen ou maiúsculas são rejeitados na ingestão (use "marca_a", não "marca-a")
+TENANT_ID_PATTERN = re.compile(r"^[a-z0-9_]+$")
+
 # Modelo E5-base multilíngue
 MODEL_NAME = "intfloat/multilingual-e5-base"
 EMBED_DIMENSION = 768  # Dimensão dos embeddings para o modelo E5-base
 
+# Similaridade de cosseno a partir da qual um FAQ é considerado quase duplicado
+NEAR_DUPLICATE_SIMILARITY = 0.97
+# Jaccard mínimo entre as respostas para mesclar; abaixo disso o par só é sinalizado
+NEAR_DUPLICATE_ANSWER_JACCARD = 0.6
+
+# Cache de respostas pré-renderizadas (checagem de tom segundo as diretrizes do agente)
+EMOJI_PATTERN = re.compile(
+    "[\U0001F300-\U0001FAFF\U00002600-\U000027BF\U0001F000-\U0001F2FF]"
+)
+INFORMAL_TERMS = {"vc", "vcs", "tb", "tbm", "pq", "blz", "vlw", "kkk", "rs", "mano"}
+
 # Carregar o tokenizer e o modelo
 tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
 model = AutoModel.from_pretrained(MODEL_NAME)
@@ -33,17 +57,64 @@ def create_table(conn):
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS faq_embeddings (
-            id TEXT PRIMARY KEY,
+            tenant_id TEXT NOT NULL DEFAULT 'default',
+            id TEXT NOT NULL,
             pergunta TEXT,
             resposta TEXT,
             categoria TEXT,
             palavras_chave TEXT[],
             perguntas_relacionadas TEXT[],
             embedding VECTOR(768),
-            metadata JSONB
+            metadata JSONB,
+            resposta_renderizada TEXT,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (tenant_id, id)
         );
         """
     )
+    # Migração de tabelas criadas antes do cache de respostas
+    cur.execute(
+        "ALTER TABLE faq_embeddings ADD COLUMN IF NOT EXISTS resposta_renderizada TEXT;"
+    )
+    # Migração: updated_at permite ao índice local detectar uma nova ingestão
+    cur.execute(
+        "ALTER TABLE faq_embeddings ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();"
+    )
+    # Migração de tabelas criadas antes do suporte a múltiplos tenants
+    cur.execute(
+        """
+        ALTER TABLE faq_embeddings ADD COLUMN IF NOT EXISTS tenant_id TEXT NOT NULL DEFAULT 'default';
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.key_column_usage
+                WHERE table_name = 'faq_embeddings'
+                  AND constraint_name = 'faq_embeddings_pkey'
+                  AND column_name = 'tenant_id'
+            ) THEN
+                ALTER TABLE faq_embeddings DROP CONSTRAINT IF EXISTS faq_embeddings_pkey;
+                ALTER TABLE faq_embeddings ADD PRIMARY KEY (tenant_id, id);
+            END IF;
+        END $$;
+        """
+    )
+    conn.commit()
+    cur.close()
+
+
+def create_tenant_index(conn, tenant_id):
+    """Criar o índice HNSW parcial do tenant, para que a busca toque apenas seus vetores."""
+    if not TENANT_ID_PATTERN.match(tenant_id):
+        raise ValueError(f"tenant_id inválido: {tenant_id!r}")
+
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS faq_embeddings_{tenant_id}_hnsw_idx
+        ON faq_embeddings USING hnsw (embedding vector_cosine_ops)
+        WHERE tenant_id = '{tenant_id}';
+        """
+    )
     conn.commit()
     cur.close()
 
@@ -81,6 +152,39 @@ def get_embedding_from_model(text: str) -> list:
     return normalized.squeeze().tolist()
 
 
+def render_cached_answer(resposta: str):
+    """Pré-renderiza a resposta do FAQ para o cache, ou retorna None se falhar na checagem de tom."""
+    text = re.sub(r"\s+", " ", resposta).strip()
+    if len(text) < 15:
+        return None
+
+    # Diretriz do agente: nunca usar emojis, linguagem informal ou gírias
+    if EMOJI_PATTERN.search(text) or "!!" in text:
+        return None
+    words = set(re.findall(r"\w+", text.lower()))
+    if words & INFORMAL_TERMS:
+        return None
+
+    text = text[0].upper() + text[1:]
+    if text[-1] not in ".?":
+        text += "."
+    return text
+
+
+def find_near_duplicate(embedding_vector, accepted_ids, accepted_vectors):
+    """Retorna (id, similaridade) do FAQ já aceito mais próximo, se for quase duplicado."""
+    if not accepted_vectors:
+        return None
+
+    # Os vetores são normalizados, então o produto interno é a similaridade de cosseno
+    similarities = torch.stack(accepted_vectors) @ torch.tensor(embedding_vector)
+    best = int(torch.argmax(similarities))
+    similarity = float(similarities[best])
+    if similarity >= NEAR_DUPLICATE_SIMILARITY:
+        return accepted_ids[best], similarity
+    return None
+
+
 def insert_or_update_embedding_row(
     cur,
     id_faq,
@@ -91,17 +195,19 @@ def insert_or_update_embedding_row(
     perguntas_relacionadas,
     embedding_vector,
     metadata,  # novo campo
+    resposta_renderizada=None,
+    tenant_id=TENANT_ID,
 ):
     """Inserir ou atualizar uma linha na tabela faq_embeddings."""
-    check_query = "SELECT id FROM faq_embeddings WHERE id = %s"
-    cur.execute(check_query, (id_faq,))
+    check_query = "SELECT id FROM faq_embeddings WHERE tenant_id = %s AND id = %s"
+    cur.execute(check_query, (tenant_id, id_faq))
     existing_item = cur.fetchone()
 
     if existing_item:
         update_query = """
             UPDATE faq_embeddings
-            SET pergunta = %s, resposta = %s, categoria = %s, palavras_chave = %s, perguntas_relacionadas = %s, embedding = %s, metadata = %s
-            WHERE id = %s
+            SET pergunta = %s, resposta = %s, categoria = %s, palavras_chave = %s, perguntas_relacionadas = %s, embedding = %s, metadata = %s, resposta_renderizada = %s, updated_at = now()
+            WHERE tenant_id = %s AND id = %s
         """
         cur.execute(
             update_query,
@@ -113,17 +219,20 @@ def insert_or_update_embedding_row(
                 perguntas_relacionadas,
                 embedding_vector,
                 json.dumps(metadata),
+                resposta_renderizada,
+                tenant_id,
                 id_faq,
             ),
         )
     else:
         insert_query = """
-            INSERT INTO faq_embeddings (id, pergunta, resposta, categoria, palavras_chave, perguntas_relacionadas, embedding, metadata)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
+            INSERT INTO faq_embeddings (tenant_id, id, pergunta, resposta, categoria, palavras_chave, perguntas_relacionadas, embedding, metadata, resposta_renderizada)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
         """
         cur.execute(
             insert_query,
             (
+                tenant_id,
                 id_faq,
                 pergunta,
                 resposta,
@@ -132,15 +241,23 @@ def insert_or_update_embedding_row(
                 perguntas_relacionadas,
                 embedding_vector,
                 json.dumps(metadata),
+                resposta_renderizada,
             ),
         )
 
 
-def process_json_and_store_embeddings(json_file_path):
-    """Processar o JSON e armazenar embeddings no banco."""
+def process_json_and_store_embeddings(json_file_path, tenant_id=TENANT_ID):
+    """Processar o JSON e armazenar embeddings do tenant no banco."""
     conn = connect_to_postgres()
+    create_tenant_index(conn, tenant_id)
     cur = conn.cursor()
 
+    # FAQs aceitos nesta execução (por id), usados para mesclar quase duplicados
+    accepted_rows = {}
+    accepted_ids = []
+    accepted_vectors = []
+    duplicate_ids = []
+
     try:
         with open(json_file_path, "r", encoding="utf-8") as f:
             data = json.load(f)
@@ -166,6 +283,41 @@ def process_json_and_store_embeddings(json_file_path):
                     # Gerar embedding
                     embedding_vector = get_embedding_from_model(embedding_input)
 
+                    # Mesclar FAQs quase duplicados no FAQ já aceito mais próximo
+                    duplicate = find_near_duplicate(
+                        embedding_vector, accepted_ids, accepted_vectors
+                    )
+                    kept = accepted_rows[duplicate[0]] if duplicate else None
+                    answers_agree = kept is not None and (
+                        jaccard(shingles(kept["resposta"]), shingles(resposta))
+                        >= NEAR_DUPLICATE_ANSWER_JACCARD
+                    )
+                    if duplicate and answers_agree:
+                        kept["perguntas_relacionadas"] = [
+                            q
+                            for q in dict.fromkeys(
+                                kept["perguntas_relacionadas"]
+                                + [pergunta]
+                                + perguntas_relacionadas
+                            )
+                            if q != kept["pergunta"]
+                        ]
+                        kept["palavras_chave"] = list(
+                            dict.fromkeys(kept["palavras_chave"] + palavras_chave)
+                        )
+                        kept["metadata"]["tags"] = kept["palavras_chave"]
+                        kept["metadata"].setdefault("ids_mesclados", []).extend(
+                            [id_faq] + item.get("ids_mesclados", [])
+                        )
+                        kept["mesclado"] = True
+                        duplicate_ids.append(id_faq)
+                        duplicate_ids.extend(item.get("ids_mesclados", []))
+                        print(
+                            f"FAQ {id_faq} mesclado em {duplicate[0]} "
+                            f"(similaridade {duplicate[1]:.3f})."
+                        )
+                        continue
+
                     # Criar metadata estruturado
                     metadata = {
                         "categoria": categoria,
@@ -173,23 +325,79 @@ def process_json_and_store_embeddings(json_file_path):
                         "origem": "faq",
                         "idioma": "pt",
                     }
+                    if item.get("ids_mesclados"):
+                        metadata["ids_mesclados"] = list(item["ids_mesclados"])
+                        # Mesclados pelo refactor_json: remover linhas de ingestões anteriores
+                        duplicate_ids.extend(item["ids_mesclados"])
+                    if duplicate:
+                        # Embedding quase igual, mas respostas diferentes: apenas sinalizar
+                        metadata["possivel_duplicado_de"] = duplicate[0]
+                        print(
+                            f"FAQ {id_faq} parecido com {duplicate[0]} "
+                            f"(similaridade {duplicate[1]:.3f}), mas com resposta diferente; "
+                            "mantido."
+                        )
 
-                    # Inserir ou atualizar no banco
-                    insert_or_update_embedding_row(
-                        cur,
-                        id_faq,
-                        pergunta,
-                        resposta,
-                        categoria,
-                        palavras_chave,
-                        perguntas_relacionadas,
-                        embedding_vector,
-                        metadata,
-                    )
+                    # Resposta pré-renderizada para o atalho sem LLM do agente
+                    resposta_renderizada = render_cached_answer(resposta)
+                    if resposta_renderizada is None:
+                        print(f"FAQ {id_faq} fora do cache: reprovado na checagem de tom.")
+
+                    # A gravação fica para depois, quando os duplicados já foram mesclados
+                    accepted_rows[id_faq] = {
+                        "pergunta": pergunta,
+                        "resposta": resposta,
+                        "categoria": categoria,
+                        "palavras_chave": list(palavras_chave),
+                        "perguntas_relacionadas": list(perguntas_relacionadas),
+                        "embedding_vector": embedding_vector,
+                        "metadata": metadata,
+                        "resposta_renderizada": resposta_renderizada,
+                        "mesclado": False,
+                    }
+                    accepted_ids.append(id_faq)
+                    accepted_vectors.append(torch.tensor(embedding_vector))
                 except Exception as e:
                     print(f"Erro ao processar item {item.get('id')}: {e}")
                     continue
 
+        # Inserir ou atualizar no banco
+        for id_faq, row in accepted_rows.items():
+            # Recalcular o embedding dos FAQs que receberam perguntas mescladas
+            if row["mesclado"]:
+                row["embedding_vector"] = get_embedding_from_model(
+                    build_embedding_input(
+                        {
+                            "pergunta_principal": row["pergunta"],
+                            "resposta": row["resposta"],
+                            "perguntas_relacionadas": row["perguntas_relacionadas"],
+                        }
+                    ).replace("passage: ", "", 1)
+                )
+
+            insert_or_update_embedding_row(
+                cur,
+                id_faq,
+                row["pergunta"],
+                row["resposta"],
+                row["categoria"],
+                row["palavras_chave"],
+                row["perguntas_relacionadas"],
+                row["embedding_vector"],
+                row["metadata"],
+                row["resposta_renderizada"],
+                tenant_id,
+            )
+
+        # Remover linhas de ingestões anteriores dos FAQs mesclados
+        for id_faq in dict.fromkeys(duplicate_ids):
+            if id_faq in accepted_rows:
+                continue
+            cur.execute(
+                "DELETE FROM faq_embeddings WHERE tenant_id = %s AND id = %s",
+                (tenant_id, id_faq),
+            )
+
         conn.commit()
     except Exception as e:
         conn.rollback()
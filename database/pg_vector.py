@@ -1,9 +1,12 @@
 import os
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 from dotenv import load_dotenv
 from typing import List
 
+from resilience import CircuitBreaker
+
 load_dotenv()
 
 # Carregar variáveis de ambiente
@@ -13,60 +16,160 @@ DB_USER = os.getenv("SUPABASE_DB_USER")
 DB_PASSWORD = os.getenv("SUPABASE_DB_PASSWORD")
 DB_PORT = os.getenv("SUPABASE_DB_PORT")
 
+# Prazos para que um banco lento não segure o worker
+DB_CONNECT_TIMEOUT = int(os.getenv("SUPABASE_DB_CONNECT_TIMEOUT", "2"))  # segundos
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("SUPABASE_DB_STATEMENT_TIMEOUT_MS", "1000"))
+# Carga completa do corpus de um tenant (índice local): prazo próprio, bem maior
+DB_BULK_STATEMENT_TIMEOUT_MS = int(
+    os.getenv("SUPABASE_DB_BULK_STATEMENT_TIMEOUT_MS", "60000")
+)
+# Conexões simultâneas de busca (no máximo uma por thread de busca)
+DB_POOL_SIZE = int(os.getenv("SUPABASE_DB_POOL_SIZE", "16"))
+
+CONNECTION_KWARGS = dict(
+    host=DB_HOST,
+    database=DB_NAME,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    port=DB_PORT,
+    connect_timeout=DB_CONNECT_TIMEOUT,
+    # Detecta host travado ou pacotes perdidos em vez de bloquear a conexão
+    keepalives=1,
+    keepalives_idle=5,
+    keepalives_interval=2,
+    keepalives_count=2,
+    tcp_user_timeout=DB_STATEMENT_TIMEOUT_MS + 1000,
+)
+
 
 class SupabaseVectorDB:
     def __init__(self):
-        self._connection = None
-        self._connect()
-
-    def _connect(self):
-        """Estabelece conexão com o banco."""
-        if not self._connection or self._connection.closed != 0:
-            try:
-                self._connection = psycopg2.connect(
-                    host=DB_HOST,
-                    database=DB_NAME,
-                    user=DB_USER,
-                    password=DB_PASSWORD,
-                    port=DB_PORT,
-                )
-                self._connection.autocommit = True
-            except psycopg2.Error as e:
-                raise ConnectionError(f"Erro ao conectar ao banco: {e}")
+        # Pool com conexões sob demanda (minconn=0): o agente sobe mesmo com o banco
+        # fora do ar, e cada thread de busca usa sua própria conexão
+        self._pool = ThreadedConnectionPool(0, DB_POOL_SIZE, **CONNECTION_KWARGS)
+        # Após falhas seguidas, a busca retorna vazio imediatamente até o banco voltar
+        self._breaker = CircuitBreaker(
+            "supabase", failure_threshold=3, reset_timeout=15
+        )
+        # Circuito separado para a carga completa, que não deve bloquear a busca
+        self._bulk_breaker = CircuitBreaker(
+            "supabase_bulk", failure_threshold=2, reset_timeout=60
+        )
 
     def close(self):
-        """Fecha a conexão com o banco."""
-        if self._connection and not self._connection.closed:
-            self._connection.close()
+        """Fecha as conexões do pool."""
+        if not self._pool.closed:
+            self._pool.closeall()
+
+    def record_timeout(self):
+        """Conta como falha uma busca que estourou o prazo do chamador.
+
+        Um banco travado não gera exceção dentro do prazo da requisição; sem isso o
+        circuito nunca abriria e cada turno esperaria o prazo inteiro.
+        """
+        self._breaker.record_failure()
 
     def search_similar_faqs(
         self,
         query_embedding: List[float],
         top_k: int = 3,
         similarity_threshold: float = 0.4,
+        tenant_id: str = "default",
     ) -> List[dict]:
-        """Busca as FAQs mais semelhantes usando pgvector."""
-        self._connect()
+        """Busca as FAQs do tenant mais semelhantes usando pgvector."""
+        if not self._breaker.allow_request():
+            return []
 
+        # SET LOCAL vale só para esta transação, então funciona também atrás do pooler
+        # do Supabase. Ordenar pela distância (e não pela similaridade calculada)
+        # permite que o planner use o índice HNSW parcial do tenant
         query = """
+            SET LOCAL statement_timeout = %s;
             SELECT
                 id,
                 pergunta,
                 resposta,
+                resposta_renderizada,
                 1 - (embedding <=> %s::vector) AS similaridade
             FROM faq_embeddings
-            ORDER BY similaridade DESC
+            WHERE tenant_id = %s
+            ORDER BY embedding <=> %s::vector
             LIMIT %s;
         """
         try:
-            with self._connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(query, (query_embedding, top_k * 2))
+            connection = self._pool.getconn()
+        except PoolError as e:
+            # Pool cheio é excesso de carga local, não falha do banco
+            print(f"Sem conexão disponível no pool: {e}")
+            return []
+        except psycopg2.Error as e:
+            self._breaker.record_failure()
+            print(f"Erro ao conectar ao banco: {e}")
+            return []
+
+        broken = False
+        try:
+            with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    query,
+                    (
+                        DB_STATEMENT_TIMEOUT_MS,
+                        query_embedding,
+                        tenant_id,
+                        query_embedding,
+                        top_k * 2,
+                    ),
+                )
                 results = cursor.fetchall()
+            connection.rollback()
         except Exception as e:
+            broken = True
+            self._breaker.record_failure()
             print(f"Erro ao executar a consulta: {e}")
             return []
+        finally:
+            self._pool.putconn(connection, close=broken or connection.closed != 0)
+        self._breaker.record_success()
 
         return [r for r in results if r["similaridade"] >= similarity_threshold][:top_k]
 
+    def load_tenant_faqs(self, tenant_id: str = "default") -> List[dict]:
+        """Carrega todas as FAQs do tenant, com embeddings, para o índice local."""
+        query = """
+            SELECT id, pergunta, resposta, resposta_renderizada, embedding::text AS embedding
+            FROM faq_embeddings
+            WHERE tenant_id = %s;
+        """
+        return self._bulk_breaker.call(self._fetch_all_bulk, query, (tenant_id,))
+
+    def tenant_version(self, tenant_id: str = "default") -> tuple:
+        """Versão do corpus do tenant (quantidade de linhas, última atualização)."""
+        query = """
+            SELECT count(*) AS total, max(updated_at) AS ultima_atualizacao
+            FROM faq_embeddings
+            WHERE tenant_id = %s;
+        """
+        row = self._bulk_breaker.call(self._fetch_all_bulk, query, (tenant_id,))[0]
+        return row["total"], row["ultima_atualizacao"]
+
+    def _fetch_all_bulk(self, query: str, params: tuple) -> List[dict]:
+        """Executa a consulta em uma conexão própria, com o prazo de carga completa."""
+        try:
+            connection = psycopg2.connect(
+                **{**CONNECTION_KWARGS, "tcp_user_timeout": DB_BULK_STATEMENT_TIMEOUT_MS}
+            )
+        except psycopg2.Error as e:
+            raise ConnectionError(f"Erro ao conectar ao banco: {e}")
+
+        try:
+            with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    "SET LOCAL statement_timeout = %s", (DB_BULK_STATEMENT_TIMEOUT_MS,)
+                )
+                cursor.execute(query, params)
+                return cursor.fetchall()
+        finally:
+            connection.close()
+
     def __del__(self):
         self.close()
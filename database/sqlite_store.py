@@ -0,0 +1,231 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+
+import ormsgpack
+from langgraph.store.base import (
+    BaseStore,
+    GetOp,
+    Item,
+    ListNamespacesOp,
+    MatchCondition,
+    Op,
+    PutOp,
+    Result,
+    SearchItem,
+    SearchOp,
+)
+
+# Caminho padrão do arquivo SQLite (mesma pasta usada pelo servidor local)
+STORE_PATH = os.getenv("LANGGRAPH_STORE_PATH", ".langgraph_api/store.sqlite")
+
+# Versão do formato em disco (esquema + payload msgpack), gravada em PRAGMA user_version.
+# Ao mudar o formato, incremente e adicione a migração em SQLiteMsgpackStore._migrate.
+STORE_FORMAT_VERSION = 1
+
+# O BaseStore não permite pontos nos rótulos do namespace, então é um separador seguro
+NAMESPACE_SEPARATOR = "."
+
+
+def _to_datetime(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def _matches(namespace: tuple, condition: MatchCondition) -> bool:
+    """Verifica se o namespace atende a condição de prefixo/sufixo (com curinga "*")."""
+    path = tuple(condition.path)
+    if len(path) > len(namespace):
+        return False
+    if condition.match_type == "prefix":
+        labels = namespace[: len(path)]
+    else:
+        labels = namespace[-len(path) :]
+    return all(p == "*" or p == label for p, label in zip(path, labels))
+
+
+class SQLiteMsgpackStore(BaseStore):
+    """BaseStore persistido em SQLite (WAL), com valores serializados em msgpack.
+
+    Cada put grava apenas a linha alterada e nada é carregado na inicialização:
+    as leituras vão direto ao banco, então o tamanho do store não afeta o restart.
+    """
+
+    def __init__(self, path: str = STORE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._migrate()
+
+    def _migrate(self):
+        """Cria ou migra o esquema até STORE_FORMAT_VERSION."""
+        (version,) = self._conn.execute("PRAGMA user_version;").fetchone()
+        if version > STORE_FORMAT_VERSION:
+            raise RuntimeError(
+                f"Store na versão {version}, mais nova que a suportada "
+                f"({STORE_FORMAT_VERSION})."
+            )
+
+        if version < 1:
+            # Arquivos criados antes do controle de versão já usam o formato 1
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS store (
+                    prefix TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (prefix, key)
+                ) WITHOUT ROWID;
+                """
+            )
+
+        self._conn.execute(f"PRAGMA user_version = {STORE_FORMAT_VERSION};")
+
+    def close(self):
+        """Fecha a conexão com o banco."""
+        with self._lock:
+            self._conn.close()
+
+    # --------------------- BaseStore ---------------------
+    def batch(self, ops: Iterable[Op]) -> List[Result]:
+        results: List[Result] = []
+        with self._lock:
+            self._conn.execute("BEGIN;")
+            try:
+                for op in ops:
+                    if isinstance(op, GetOp):
+                        results.append(self._get(op))
+                    elif isinstance(op, PutOp):
+                        results.append(self._put(op))
+                    elif isinstance(op, SearchOp):
+                        results.append(self._search(op))
+                    elif isinstance(op, ListNamespacesOp):
+                        results.append(self._list_namespaces(op))
+                    else:
+                        raise ValueError(f"Operação não suportada: {type(op)}")
+                self._conn.execute("COMMIT;")
+            except Exception:
+                self._conn.execute("ROLLBACK;")
+                raise
+        return results
+
+    async def abatch(self, ops: Iterable[Op]) -> List[Result]:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.batch, list(ops)
+        )
+
+    # --------------------- OPERAÇÕES ---------------------
+    def _get(self, op: GetOp) -> Optional[Item]:
+        row = self._conn.execute(
+            "SELECT value, created_at, updated_at FROM store WHERE prefix = ? AND key = ?",
+            (NAMESPACE_SEPARATOR.join(op.namespace), op.key),
+        ).fetchone()
+        if not row:
+            return None
+        value, created_at, updated_at = row
+        return Item(
+            value=ormsgpack.unpackb(value),
+            key=op.key,
+            namespace=op.namespace,
+            created_at=_to_datetime(created_at),
+            updated_at=_to_datetime(updated_at),
+        )
+
+    def _put(self, op: PutOp) -> None:
+        prefix = NAMESPACE_SEPARATOR.join(op.namespace)
+        if op.value is None:
+            self._conn.execute(
+                "DELETE FROM store WHERE prefix = ? AND key = ?", (prefix, op.key)
+            )
+            return None
+
+        now = time.time()
+        self._conn.execute(
+            """
+            INSERT INTO store (prefix, key, value, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (prefix, key)
+            DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at;
+            """,
+            (prefix, op.key, ormsgpack.packb(op.value), now, now),
+        )
+        return None
+
+    def _search(self, op: SearchOp) -> List[SearchItem]:
+        # Busca semântica (op.query) não é suportada: apenas prefixo e filtro exato
+        prefix = NAMESPACE_SEPARATOR.join(op.namespace_prefix)
+        if prefix:
+            rows = self._conn.execute(
+                """
+                SELECT prefix, key, value, created_at, updated_at FROM store
+                WHERE prefix = ? OR substr(prefix, 1, ?) = ?
+                ORDER BY updated_at DESC
+                """,
+                (prefix, len(prefix) + 1, prefix + NAMESPACE_SEPARATOR),
+            )
+        else:
+            rows = self._conn.execute(
+                "SELECT prefix, key, value, created_at, updated_at FROM store "
+                "ORDER BY updated_at DESC"
+            )
+
+        items: List[SearchItem] = []
+        skipped = 0
+        for row_prefix, key, value, created_at, updated_at in rows:
+            decoded = ormsgpack.unpackb(value)
+            if op.filter and not all(
+                decoded.get(field) == expected for field, expected in op.filter.items()
+            ):
+                continue
+            if skipped < op.offset:
+                skipped += 1
+                continue
+            items.append(
+                SearchItem(
+                    namespace=tuple(row_prefix.split(NAMESPACE_SEPARATOR)),
+                    key=key,
+                    value=decoded,
+                    created_at=_to_datetime(created_at),
+                    updated_at=_to_datetime(updated_at),
+                )
+            )
+            if len(items) >= op.limit:
+                break
+        return items
+
+    def _list_namespaces(self, op: ListNamespacesOp) -> List[tuple]:
+        namespaces = set()
+        for (prefix,) in self._conn.execute("SELECT DISTINCT prefix FROM store"):
+            namespace = tuple(prefix.split(NAMESPACE_SEPARATOR))
+            if op.match_conditions and not all(
+                _matches(namespace, condition) for condition in op.match_conditions
+            ):
+                continue
+            if op.max_depth is not None:
+                namespace = namespace[: op.max_depth]
+            namespaces.add(namespace)
+        return sorted(namespaces)[op.offset : op.offset + op.limit]
+
+
+# --------------------- LANGGRAPH SERVER ---------------------
+@asynccontextmanager
+async def generate_store():
+    """Fornece o store para o servidor LangGraph (chave "store.path" do langgraph.json)."""
+    store = SQLiteMsgpackStore()
+    try:
+        yield store
+    finally:
+        store.close()
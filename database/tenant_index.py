@@ -0,0 +1,111 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from database.pg_vector import SupabaseVectorDB
+
+# Intervalo (s) entre verificações de nova ingestão do tenant
+INDEX_CHECK_INTERVAL = float(os.getenv("FAQ_INDEX_CHECK_INTERVAL", "60"))
+
+
+class TenantFaqIndex:
+    """Índice em memória das FAQs, particionado por tenant.
+
+    Cada tenant é mantido em uma matriz própria, então a busca de uma marca nunca
+    percorre os vetores de outra. A carga do tenant começa na primeira busca, em
+    segundo plano (fora do prazo da requisição); até ela terminar, a busca é feita
+    no pgvector. A cada INDEX_CHECK_INTERVAL segundos, uma busca dispara em segundo
+    plano a comparação da versão do corpus (linhas e última atualização) e a
+    partição é recarregada se o tenant foi reingerido.
+    """
+
+    def __init__(self, vector_db: SupabaseVectorDB):
+        self._vector_db = vector_db
+        self._partitions: Dict[str, Tuple[np.ndarray, List[dict]]] = {}
+        self._versions: Dict[str, tuple] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._loading = set()
+        self._lock = threading.Lock()
+
+    def _partition(self, tenant_id: str) -> Optional[Tuple[np.ndarray, List[dict]]]:
+        """Retorna a partição do tenant, disparando a carga/verificação quando preciso."""
+        partition = self._partitions.get(tenant_id)
+        stale = (
+            time.monotonic() - self._checked_at.get(tenant_id, 0.0)
+            >= INDEX_CHECK_INTERVAL
+        )
+        if partition is not None and not stale:
+            return partition
+
+        with self._lock:
+            if tenant_id not in self._loading:
+                self._loading.add(tenant_id)
+                threading.Thread(
+                    target=self._load,
+                    args=(tenant_id,),
+                    name=f"faq-index-{tenant_id}",
+                    daemon=True,
+                ).start()
+        # Enquanto verifica, continua servindo a partição atual (se houver)
+        return partition
+
+    def _load(self, tenant_id: str):
+        """Carrega a partição se a versão do corpus mudou; falhas são tentadas de novo."""
+        try:
+            version = self._vector_db.tenant_version(tenant_id)
+            if (
+                tenant_id not in self._partitions
+                or self._versions.get(tenant_id) != version
+            ):
+                rows = self._vector_db.load_tenant_faqs(tenant_id)
+                matrix = np.array(
+                    [json.loads(r["embedding"]) for r in rows], dtype=np.float32
+                )
+                faqs = [
+                    {k: v for k, v in r.items() if k != "embedding"} for r in rows
+                ]
+                self._partitions[tenant_id] = (matrix, faqs)
+                self._versions[tenant_id] = version
+            self._checked_at[tenant_id] = time.monotonic()
+        except Exception as e:
+            print(f"Erro ao carregar o índice local do tenant {tenant_id}: {e!r}")
+        finally:
+            with self._lock:
+                self._loading.discard(tenant_id)
+
+    def search_similar_faqs(
+        self,
+        query_embedding: List[float],
+        top_k: int = 3,
+        similarity_threshold: float = 0.4,
+        tenant_id: str = "default",
+    ) -> List[dict]:
+        """Mesma interface de SupabaseVectorDB.search_similar_faqs; sem ida ao banco após a carga."""
+        partition = self._partition(tenant_id)
+        if partition is None:
+            return self._vector_db.search_similar_faqs(
+                query_embedding,
+                top_k=top_k,
+                similarity_threshold=similarity_threshold,
+                tenant_id=tenant_id,
+            )
+
+        matrix, faqs = partition
+        if not faqs:
+            return []
+
+        # Embeddings normalizados: o produto interno é a similaridade de cosseno
+        similarities = matrix @ np.asarray(query_embedding, dtype=np.float32)
+        k = min(top_k, len(faqs))
+        best = np.argpartition(-similarities, k - 1)[:k]
+        best = best[np.argsort(-similarities[best])]
+
+        return [
+            {**faqs[i], "similaridade": float(similarities[i])}
+            for i in best
+            if similarities[i] >= similarity_threshold
+        ]
@@ -1,6 +1,21 @@
 import json
 import re
 import argparse
+import random
+import zlib
+
+# Near-duplicate detection (MinHash + LSH)
+SHINGLE_SIZE = 3  # Words per shingle
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 32  # 32 bands x 4 rows -> candidates from ~0.4 Jaccard upwards
+NEAR_DUPLICATE_THRESHOLD = 0.8  # Minimum Jaccard similarity to merge two FAQs
+_MERSENNE_PRIME = (1 << 61) - 1
+# Universal hash parameters (a, b), fixed seed so signatures are reproducible
+_rng = random.Random(42)
+_MINHASH_PARAMS = [
+    (_rng.randint(1, _MERSENNE_PRIME - 1), _rng.randint(0, _MERSENNE_PRIME - 1))
+    for _ in range(MINHASH_PERMUTATIONS)
+]
 
 
 def clean_text(text):
@@ -93,13 +108,142 @@ def is_valid_content(text):
     return True
 
 
-def process_data(input_file, output_file):
+def shingles(text, size=SHINGLE_SIZE):
+    """
+    Splits the text into a set of lowercase word shingles of the given size.
+    """
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a, b):
+    """
+    Exact Jaccard similarity between two shingle sets.
+    """
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def minhash_signature(shingle_set):
+    """
+    Computes a MinHash signature using universal hashing over CRC32 shingle hashes.
+    """
+    hashes = [zlib.crc32(item.encode("utf-8")) for item in shingle_set]
+    if not hashes:
+        return [_MERSENNE_PRIME] * len(_MINHASH_PARAMS)
+    return [
+        min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _MINHASH_PARAMS
+    ]
+
+
+def lsh_candidate_pairs(signatures, bands=LSH_BANDS):
+    """
+    Groups signatures into LSH buckets and returns the index pairs that share a bucket.
+    """
+    if not signatures:
+        return set()
+    rows = len(signatures[0]) // bands
+    candidates = set()
+    for band in range(bands):
+        buckets = {}
+        for index, signature in enumerate(signatures):
+            key = tuple(signature[band * rows : (band + 1) * rows])
+            buckets.setdefault(key, []).append(index)
+        for bucket in buckets.values():
+            for i in range(len(bucket)):
+                for j in range(i + 1, len(bucket)):
+                    candidates.add((bucket[i], bucket[j]))
+    return candidates
+
+
+def find_near_duplicates(objects, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Finds clusters of near-duplicate FAQs based on question and answer shingles.
+    Returns a list of clusters (lists of indexes), each with more than one element.
+    """
+    shingle_sets = [
+        shingles(f"{obj.get('pergunta_principal', '')} {obj.get('resposta', '')}")
+        for obj in objects
+    ]
+    signatures = [minhash_signature(item) for item in shingle_sets]
+
+    # Union-find over the confirmed pairs
+    parent = list(range(len(objects)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in lsh_candidate_pairs(signatures):
+        # LSH only proposes candidates; confirm with the exact similarity
+        if jaccard(shingle_sets[i], shingle_sets[j]) >= threshold:
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    clusters = {}
+    for index in range(len(objects)):
+        clusters.setdefault(find(index), []).append(index)
+    return [sorted(c) for c in clusters.values() if len(c) > 1]
+
+
+def merge_near_duplicates(objects, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Merges near-duplicate FAQs into the first object of each cluster.
+    The duplicates' questions become related questions of the kept object, keywords are
+    combined and the merged ids are recorded in "ids_mesclados".
+    Returns the deduplicated list and the number of objects merged away.
+    """
+    clusters = find_near_duplicates(objects, threshold)
+    removed = set()
+
+    for cluster in clusters:
+        kept = objects[cluster[0]]
+        related = list(kept.get("perguntas_relacionadas", []))
+        keywords = list(kept.get("palavras_chave", []))
+        merged_ids = list(kept.get("ids_mesclados", []))
+
+        for index in cluster[1:]:
+            duplicate = objects[index]
+            related.append(duplicate.get("pergunta_principal", ""))
+            related.extend(duplicate.get("perguntas_relacionadas", []))
+            keywords.extend(duplicate.get("palavras_chave", []))
+            merged_ids.append(duplicate.get("id"))
+            removed.add(index)
+
+        kept_question = kept.get("pergunta_principal")
+        kept["perguntas_relacionadas"] = [
+            q for q in dict.fromkeys(related) if q and q != kept_question
+        ]
+        kept["palavras_chave"] = list(dict.fromkeys(keywords))
+        kept["ids_mesclados"] = merged_ids
+
+    deduplicated = [obj for i, obj in enumerate(objects) if i not in removed]
+    return deduplicated, len(removed)
+
+
+def build_embedding_input(obj):
+    """
+    Builds the "embedding_input" field from the question, answer and related questions.
+    """
+    related_questions = ", ".join(obj.get("perguntas_relacionadas", []))
+    return f"passage: {obj['pergunta_principal']} {obj['resposta']} {related_questions}"
+
+
+def process_data(input_file, output_file, dedup_threshold=NEAR_DUPLICATE_THRESHOLD):
     """
     Processes the input JSON file, corrects the objects, and generates a new JSON file.
+    Near-duplicate FAQs are merged when dedup_threshold is set (None disables it).
     """
     total_read = 0
     total_discarded = 0
     total_corrected = 0
+    total_merged = 0
 
     try:
         with open(input_file, "r", encoding="utf-8") as f:
@@ -205,10 +349,7 @@ def process_data(input_file, output_file):
 
         # Add a new field "embedding_input"
         if "pergunta_principal" in cleaned_obj and "resposta" in cleaned_obj:
-            related_questions = ", ".join(cleaned_obj.get("perguntas_relacionadas", []))
-            cleaned_obj["embedding_input"] = (
-                f"passage: {cleaned_obj['pergunta_principal']} {cleaned_obj['resposta']} {related_questions}"
-            )
+            cleaned_obj["embedding_input"] = build_embedding_input(cleaned_obj)
             corrected = True
 
         if corrected:
@@ -216,6 +357,15 @@ def process_data(input_file, output_file):
 
         processed_objects.append(cleaned_obj)
 
+    # Merge near-duplicate FAQs across records so they are embedded only once
+    if dedup_threshold is not None:
+        processed_objects, total_merged = merge_near_duplicates(
+            processed_objects, dedup_threshold
+        )
+        for obj in processed_objects:
+            if obj.get("ids_mesclados") and "embedding_input" in obj:
+                obj["embedding_input"] = build_embedding_input(obj)
+
     try:
         with open(output_file, "w", encoding="utf-8") as f:
             json.dump(processed_objects, f, indent=2, ensure_ascii=False)
@@ -226,6 +376,7 @@ def process_data(input_file, output_file):
     print(f"Total objects read: {total_read}")
     print(f"Total objects discarded: {total_discarded}")
     print(f"Total objects corrected: {total_corrected}")
+    print(f"Total near-duplicates merged: {total_merged}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,167 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+# Threads para chamadas com prazo fora do limitador (busca RAG). Uma chamada que estoura
+# o prazo é cancelada se ainda estiver na fila; se já começou, continua em segundo
+# plano, por isso cada dependência também deve ter seu próprio timeout
+# (statement_timeout no banco, timeout do cliente no Vertex). O LLM usa as threads do
+# seu limitador, então um banco degradado não atrasa as chamadas ao modelo.
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="deadline")
+
+
+class CircuitOpenError(Exception):
+    """O circuito está aberto e a chamada foi recusada sem tocar a dependência."""
+
+
+class ConcurrencyLimitError(Exception):
+    """Não houve vaga no limitador de concorrência dentro do tempo de espera."""
+
+
+def call_with_deadline(fn: Callable, timeout: float, *args, **kwargs) -> Any:
+    """Executa fn e levanta TimeoutError se ela não terminar dentro do prazo."""
+    future = _executor.submit(fn, *args, **kwargs)
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
+
+
+class CircuitBreaker:
+    """Circuit breaker simples (fechado -> aberto -> meio-aberto).
+
+    Após failure_threshold falhas seguidas o circuito abre e recusa chamadas por
+    reset_timeout segundos; depois disso uma chamada de teste decide se ele fecha.
+    """
+
+    def __init__(
+        self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._half_open_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            # Meio-aberto: libera apenas uma chamada de teste por vez
+            if state == "half_open" and not self._half_open_in_flight:
+                self._half_open_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._half_open_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._half_open_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        """Executa fn através do circuito, registrando sucesso ou falha."""
+        if not self.allow_request():
+            raise CircuitOpenError(f"Circuito '{self.name}' aberto.")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+class ConcurrencyLimiter:
+    """Semáforo limitado com métricas de fila para chamadas caras (LLM).
+
+    A vaga só é devolvida quando a chamada termina de fato, mesmo que o chamador
+    já tenha desistido por prazo, então o limite vale para as chamadas em voo.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, acquire_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.acquire_timeout = acquire_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        # Uma thread por vaga: chamadas admitidas nunca esperam na fila do executor
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix=name
+        )
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self._max_waiting = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    def _acquire(self):
+        with self._lock:
+            self._waiting += 1
+            self._max_waiting = max(self._max_waiting, self._waiting)
+        acquired = self._semaphore.acquire(timeout=self.acquire_timeout)
+        with self._lock:
+            self._waiting -= 1
+            if not acquired:
+                self._rejected += 1
+            else:
+                self._in_flight += 1
+        if not acquired:
+            raise ConcurrencyLimitError(
+                f"Sem vaga em '{self.name}' após {self.acquire_timeout}s."
+            )
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._in_flight -= 1
+        self._semaphore.release()
+
+    def call(self, fn: Callable, timeout: float, *args, **kwargs) -> Any:
+        """Aguarda uma vaga e executa fn com prazo de timeout segundos."""
+        self._acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self._timed_out += 1
+            raise
+
+    def metrics(self) -> dict:
+        """Profundidade da fila e contadores do limitador."""
+        with self._lock:
+            return {
+                "name": self.name,
+                "max_concurrency": self.max_concurrency,
+                "waiting": self._waiting,
+                "in_flight": self._in_flight,
+                "max_waiting": self._max_waiting,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+            }